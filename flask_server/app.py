@@ -4,6 +4,10 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from models import db, Patient, Medicine, Treatment
 from recommendation import get_recommendations_logic
+from structured_output import (
+    generate_structured, get_metrics, schema_example,
+    RESEARCH_SCHEMA, PROGRESSION_SCHEMA,
+)
 import os
 import time
 import google.generativeai as genai
@@ -32,16 +36,17 @@ class MockResponse:
     def __init__(self, text):
         self.text = text
 
-def generate_content_safe(prompt_text):
+def generate_content_safe(prompt_text, generation_config=None):
     try:
         print(f"DEBUG: Attempting with {primary_model_name}")
         model = genai.GenerativeModel(primary_model_name)
-        return model.generate_content(prompt_text)
+        return model.generate_content(prompt_text, generation_config=generation_config)
     except Exception as e:
         print(f"Primary model {primary_model_name} failed: {e}")
         try:
             print(f"DEBUG: Falling back to {fallback_model_name}")
             model = genai.GenerativeModel(fallback_model_name)
+            # gemini-pro does not support JSON mode, so rely on the prompt alone
             return model.generate_content(prompt_text)
         except Exception as e2:
             print(f"Fallback model {fallback_model_name} failed: {e2}")
@@ -71,27 +76,10 @@ def home():
 def log_request_info():
     print(f"DEBUG: Incoming {request.method} request to {request.path}")
 
-# --- Helper to extract JSON from AI response ---
-def extract_json(text):
-    try:
-        # Remove markdown code blocks if any
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0]
-        
-        # Strip whitespace and find the first { and last }
-        text = text.strip()
-        start = text.find('{')
-        end = text.rfind('}')
-        if start != -1 and end != -1:
-            json_text = text[start:end+1]
-            import json
-            return json.loads(json_text)
-        return None
-    except Exception as e:
-        print(f"JSON extraction error: {e}")
-        return None
+# --- Structured Output Metrics ---
+@app.route('/api/metrics/structured-output', methods=['GET'])
+def structured_output_metrics():
+    return jsonify(get_metrics())
 
 # --- Gemini AI Proxy Routes ---
 @app.route('/api/ai/chat', methods=['POST'])
@@ -114,29 +102,18 @@ def ai_chat():
 @app.route('/api/research/alzheimers', methods=['GET'])
 def get_research():
     try:
-        template = """
+        template = f"""
         You are a medical researcher. 
         Provide a structured summary of the CURRENT state of Alzheimer's Disease data (as of 2024/2025).
         
         Format the output purely as a JSON object with these keys: 
-        {{
-            "global_prevalence": "string",
-            "key_statistics": ["string", "string"],
-            "recent_breakthroughs": [
-                {{"title": "string", "summary": "string"}}
-            ],
-            "projected_growth": "string"
-        }}
+        {schema_example(RESEARCH_SCHEMA)}
         
         Keep it concise, professional, and data-driven.
         Do not include markdown filtering (```json ... ```), just the raw JSON string.
         """
         
-        response = generate_content_safe(template)
-        text = response.text
-            
-        text = text.replace('```json', '').replace('```', '').strip()
-        data = extract_json(text)
+        data = generate_structured(template, RESEARCH_SCHEMA, generate_content_safe, route='research')
         if not data:
             raise ValueError("Could not extract valid JSON from research response")
         return jsonify(data)
@@ -279,22 +256,12 @@ def analyze_progression():
         5. Suggest a medical focus area for the next doctor's visit.
         
         Format the output as a JSON object with these keys:
-        {{
-            "progression_summary": "string",
-            "cognitive_status": "Improving/Stable/Declining",
-            "key_findings": ["finding 1", "finding 2"],
-            "caregiver_recommendations": ["rec 1", "rec 2", "rec 3"],
-            "medical_focus": "string"
-        }}
+        {schema_example(PROGRESSION_SCHEMA)}
         
         Be analytical, compassionate, and precise. Just the JSON.
         """
         
-        response = generate_content_safe(prompt)
-        text = response.text
-            
-        text = text.replace('```json', '').replace('```', '').strip()
-        data = extract_json(text)
+        data = generate_structured(prompt, PROGRESSION_SCHEMA, generate_content_safe, route='progression')
         if not data:
             # Return a friendly structured error if AI fails
             return jsonify({
@@ -0,0 +1,225 @@
+import json
+import threading
+
+# Gemini generation config that asks the model for a bare JSON body
+JSON_ONLY_CONFIG = {"response_mime_type": "application/json"}
+
+# How many times a malformed or off-schema answer is sent back for repair
+MAX_REPAIR_ATTEMPTS = 2
+
+# --- Per-route schemas ---
+# Each key maps to its expected shape: str, [str], [{...}] or a tuple of allowed values.
+RESEARCH_SCHEMA = {
+    "global_prevalence": str,
+    "key_statistics": [str],
+    "recent_breakthroughs": [{"title": str, "summary": str}],
+    "projected_growth": str,
+}
+
+PROGRESSION_SCHEMA = {
+    "progression_summary": str,
+    "cognitive_status": ("Improving", "Stable", "Declining"),
+    "key_findings": [str],
+    "caregiver_recommendations": [str],
+    "medical_focus": str,
+}
+
+# --- Parse failure metrics ---
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+
+def _record(route, event):
+    with _metrics_lock:
+        counters = _metrics.setdefault(route, {
+            "requests": 0,
+            "generation_errors": 0,
+            "parse_failures": 0,
+            "validation_failures": 0,
+            "repairs": 0,
+            "successes": 0,
+            "exhausted": 0,
+        })
+        counters[event] += 1
+
+
+def get_metrics():
+    """Returns a snapshot of structured output counters keyed by route."""
+    with _metrics_lock:
+        return {route: dict(counters) for route, counters in _metrics.items()}
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+# --- Incremental JSON extraction ---
+def _opens_object(text, i):
+    # A JSON object's "{" is followed by optional whitespace and then '"' or '}'
+    j = i + 1
+    while j < len(text) and text[j] in ' \t\r\n':
+        j += 1
+    return j < len(text) and text[j] in '"}'
+
+
+def iter_json_objects(text):
+    """
+    Yields each top-level JSON object in a model response, in order.
+
+    Makes a single forward pass, tracking brace depth and string/escape state
+    so that braces inside string values do not end an object early. Prose
+    and markdown fences around the objects are skipped, as is any "{" that
+    cannot start a JSON object (e.g. "{see below}"). A candidate is decoded
+    only when the scan returns to depth 0; if it is not valid JSON (or is
+    nested too deeply to decode) the scan resumes after it, so objects
+    nested inside a failed or truncated candidate are never yielded.
+    """
+    if not text:
+        return
+
+    depth = 0
+    start = -1
+    in_string = False
+    escaped = False
+
+    for i, ch in enumerate(text):
+        if depth == 0:
+            # Outside a candidate: quotes and stray closers are just prose
+            if ch == '{' and _opens_object(text, i):
+                depth = 1
+                start = i
+            continue
+
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                try:
+                    data = json.loads(text[start:i + 1])
+                except (ValueError, RecursionError):
+                    continue
+                if isinstance(data, dict):
+                    yield data
+
+
+def extract_json(text):
+    """Returns the first top-level JSON object in a model response, or None."""
+    return next(iter_json_objects(text), None)
+
+
+# --- Schema validation ---
+def _check(value, spec, path, errors):
+    if isinstance(spec, tuple):
+        if value not in spec:
+            errors.append(f"{path} must be one of {', '.join(spec)}")
+    elif isinstance(spec, list):
+        if not isinstance(value, list):
+            errors.append(f"{path} must be a list")
+            return
+        for index, item in enumerate(value):
+            _check(item, spec[0], f"{path}[{index}]", errors)
+    elif isinstance(spec, dict):
+        if not isinstance(value, dict):
+            errors.append(f"{path} must be an object")
+            return
+        for key, sub_spec in spec.items():
+            if key not in value:
+                errors.append(f"{path}.{key} is missing" if path else f"{key} is missing")
+            else:
+                _check(value[key], sub_spec, f"{path}.{key}" if path else key, errors)
+    elif not isinstance(value, spec):
+        errors.append(f"{path} must be a {spec.__name__}")
+
+
+def validate(data, schema):
+    """Returns a list of schema violations (empty when data is valid). Extra keys are allowed."""
+    errors = []
+    _check(data, schema, "", errors)
+    return errors
+
+
+def _describe(spec):
+    if isinstance(spec, tuple):
+        return "/".join(spec)
+    if isinstance(spec, list):
+        return [_describe(spec[0])]
+    if isinstance(spec, dict):
+        return {key: _describe(sub_spec) for key, sub_spec in spec.items()}
+    return "string" if spec is str else spec.__name__
+
+
+def schema_example(schema):
+    """Renders a schema as the JSON skeleton used in prompts."""
+    return json.dumps(_describe(schema), indent=4)
+
+
+# --- Structured generation with repair ---
+def generate_structured(prompt, schema, generate, route, max_repairs=MAX_REPAIR_ATTEMPTS):
+    """
+    Asks the model for JSON-only output and validates it against the schema.
+
+    `generate` is called as generate(prompt, generation_config) and must return
+    an object with a `.text` attribute. The first JSON object in the answer that
+    matches the schema is returned. When none does, the errors are fed back in
+    a repair prompt; a failed model call is retried with the same prompt. Either
+    way at most `max_repairs` extra calls are made. Returns the validated dict,
+    or None when the budget is exhausted.
+    """
+    _record(route, "requests")
+    current_prompt = prompt
+
+    for attempt in range(max_repairs + 1):
+        if attempt > 0:
+            _record(route, "repairs")
+
+        try:
+            text = generate(current_prompt, JSON_ONLY_CONFIG).text
+        except Exception as e:
+            # e.g. the SDK raises ValueError from .text on safety-blocked responses
+            _record(route, "generation_errors")
+            print(f"DEBUG: Structured output for {route} failed to generate (attempt {attempt + 1}): {e}")
+            continue
+
+        # Prose may carry example objects; accept the first one that fits the schema
+        first = None
+        for candidate in iter_json_objects(text):
+            if not validate(candidate, schema):
+                _record(route, "successes")
+                return candidate
+            if first is None:
+                first = candidate
+
+        if first is None:
+            _record(route, "parse_failures")
+            errors = ["response did not contain a valid JSON object"]
+        else:
+            _record(route, "validation_failures")
+            errors = validate(first, schema)
+
+        print(f"DEBUG: Structured output for {route} rejected (attempt {attempt + 1}): {errors}")
+        current_prompt = f"""
+        {prompt}
+
+        Your previous answer was rejected:
+        {text[:2000]}
+
+        Problems:
+        {chr(10).join('- ' + e for e in errors)}
+
+        Reply again with only a JSON object matching exactly this structure:
+        {schema_example(schema)}
+        """
+
+    _record(route, "exhausted")
+    return None
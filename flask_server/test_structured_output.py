@@ -0,0 +1,236 @@
+import json
+import random
+import time
+
+from structured_output import (
+    extract_json, iter_json_objects, validate, generate_structured, get_metrics, reset_metrics,
+    RESEARCH_SCHEMA, PROGRESSION_SCHEMA,
+)
+
+VALID_PROGRESSION = {
+    "progression_summary": "Recall of {family} names is steady.",
+    "cognitive_status": "Stable",
+    "key_findings": ["Consistent tone", "Uses \"quoted\" phrases"],
+    "caregiver_recommendations": ["Music sessions", "Photo albums", "Daily walks"],
+    "medical_focus": "Memory screening",
+}
+BODY = json.dumps(VALID_PROGRESSION)
+
+VALID_RESEARCH = {
+    "global_prevalence": "55 million",
+    "key_statistics": ["1 in 9 people age 65+"],
+    "recent_breakthroughs": [
+        {"title": "Lecanemab", "summary": "Targets {amyloid} plaques."},
+        {"title": "Blood tests", "summary": "Earlier detection."},
+    ],
+    "projected_growth": "139 million by 2050",
+}
+RESEARCH_BODY = json.dumps(VALID_RESEARCH)
+
+# --- Malformed model outputs that should still yield the object ---
+RECOVERABLE = [
+    BODY,
+    f"```json\n{BODY}\n```",
+    f"```\n{BODY}\n```",
+    f"Here is the analysis you asked for:\n{BODY}\nLet me know if you need more.",
+    f"Sure! {{see below}}\n{BODY}",
+    f"Note: braces like }} or {{ in prose.\n```json\n{BODY}\n```\nThanks {{:)}}",
+    f"It's the patient's report: {BODY} -- that's all.",
+    f"{BODY}\n\n{{\"extra\": true}}",
+]
+
+# --- Outputs where example objects in the prose come before the real answer ---
+DECOYED = [
+    f'Example: {{"a": 1}}. Actual: {BODY}',
+    f"Template {{ }} filled in below:\n```json\n{BODY}\n```",
+    f'Earlier draft: {json.dumps(dict(VALID_PROGRESSION, cognitive_status="Unsure"))}\nFinal: {BODY}',
+]
+
+# --- Outputs that must not produce an object ---
+UNRECOVERABLE = [
+    "",
+    "I'm sorry, I can't help with that.",
+    BODY[:-1],
+    BODY[: len(BODY) // 2],
+    "{'single': 'quotes'}",
+    "[1, 2, 3]",
+    "{ trailing, }",
+    "}}}{{{",
+    RESEARCH_BODY[:-1],
+    RESEARCH_BODY[: RESEARCH_BODY.index("Blood")],
+    f"```json\n{RESEARCH_BODY[:-2]}\n```",
+    '{"a": {"title": "nested"},} trailing prose',
+]
+
+
+def test_recoverable_corpus():
+    for sample in RECOVERABLE:
+        assert extract_json(sample) == VALID_PROGRESSION, sample
+
+
+def test_unrecoverable_corpus():
+    for sample in UNRECOVERABLE:
+        assert extract_json(sample) is None, sample
+
+
+def test_decoys_are_yielded_before_the_body():
+    for sample in DECOYED:
+        candidates = list(iter_json_objects(sample))
+        assert len(candidates) == 2 and candidates[1] == VALID_PROGRESSION, sample
+
+
+def test_truncated_nested_body_is_never_a_fragment():
+    # Cutting the research body anywhere must not surface a breakthrough object
+    for end in range(len(RESEARCH_BODY)):
+        assert extract_json(RESEARCH_BODY[:end]) is None, end
+
+
+def test_random_mutations():
+    rng = random.Random(26)
+    noise = '{}[]",:\\ \nabc`'
+    prose = 'abc :,[]}"`\n'
+    for _ in range(2000):
+        chars = list(rng.choice(RECOVERABLE + UNRECOVERABLE))
+        for _ in range(rng.randint(1, 5)):
+            op = rng.randint(0, 2)
+            pos = rng.randint(0, len(chars))
+            if op == 0:
+                chars.insert(pos, rng.choice(noise))
+            elif op == 1 and chars:
+                del chars[min(pos, len(chars) - 1)]
+            else:
+                chars[pos:pos] = list(BODY[: rng.randint(0, len(BODY))])
+        result = extract_json("".join(chars))
+        assert result is None or isinstance(result, dict)
+
+        # A complete body with prose before it and arbitrary noise after it
+        prefix = "".join(rng.choice(prose) for _ in range(rng.randint(0, 20)))
+        if rng.random() < 0.5:
+            prefix += rng.choice(["{ ", "{see below}", "{:)", "{{"])
+        suffix = "".join(rng.choice(noise) for _ in range(rng.randint(0, 20)))
+        assert extract_json(prefix + BODY + suffix) == VALID_PROGRESSION, prefix + BODY + suffix
+
+
+def test_long_adversarial_inputs_stay_linear():
+    n = 50000
+    samples = [
+        "{" * n,
+        '{"' * n,
+        '{"a": ' * n,
+        '{"a": 1,} ' * n,
+        "{ " * n + BODY,
+        '{"a": {' * n + "}" * n,
+        # Balanced but too deep for json.loads to decode
+        '{"a":' * n + "1" + "}" * n,
+        '{"a":' * n + "1" + "}" * n + " " + BODY,
+    ]
+    for sample in samples:
+        began = time.perf_counter()
+        result = extract_json(sample)
+        assert time.perf_counter() - began < 2.0, sample[:20]
+        assert result is None or result == VALID_PROGRESSION, sample[:20]
+    assert extract_json('{"a":' * n + "1" + "}" * n) is None
+    assert extract_json('{"a":' * n + "1" + "}" * n + " " + BODY) == VALID_PROGRESSION
+    assert extract_json("{ " * n + BODY) == VALID_PROGRESSION
+
+
+def test_validate_reports_schema_errors():
+    assert validate(VALID_PROGRESSION, PROGRESSION_SCHEMA) == []
+    bad = dict(VALID_PROGRESSION, cognitive_status="Great", key_findings="none")
+    del bad["medical_focus"]
+    errors = validate(bad, PROGRESSION_SCHEMA)
+    assert len(errors) == 3, errors
+
+    assert validate(VALID_RESEARCH, RESEARCH_SCHEMA) == []
+    research = dict(VALID_RESEARCH, recent_breakthroughs=[{"title": "Lecanemab"}])
+    assert validate(research, RESEARCH_SCHEMA) == ["recent_breakthroughs[0].summary is missing"]
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def _scripted(outputs):
+    calls = []
+
+    def generate(prompt, generation_config=None):
+        calls.append((prompt, generation_config))
+        output = outputs[len(calls) - 1]
+        if isinstance(output, Exception):
+            raise output
+        return FakeResponse(output)
+
+    return generate, calls
+
+
+def test_generate_structured_repairs_then_succeeds():
+    reset_metrics()
+    bad = json.dumps(dict(VALID_PROGRESSION, cognitive_status="Okay"))
+    generate, calls = _scripted(["no json here", bad, BODY])
+    assert generate_structured("analyze", PROGRESSION_SCHEMA, generate, route="progression") == VALID_PROGRESSION
+    assert len(calls) == 3
+    assert calls[0][1] == {"response_mime_type": "application/json"}
+    assert "cognitive_status must be one of" in calls[2][0]
+    assert get_metrics()["progression"] == {
+        "requests": 1,
+        "generation_errors": 0,
+        "parse_failures": 1,
+        "validation_failures": 1,
+        "repairs": 2,
+        "successes": 1,
+        "exhausted": 0,
+    }
+
+
+def test_generate_structured_respects_budget():
+    reset_metrics()
+    generate, calls = _scripted(["nope"] * 5)
+    assert generate_structured("research", RESEARCH_SCHEMA, generate, route="research", max_repairs=1) is None
+    assert len(calls) == 2
+    assert get_metrics()["research"]["exhausted"] == 1
+    assert get_metrics()["research"]["parse_failures"] == 2
+
+
+def test_truncated_output_counts_as_parse_failure():
+    reset_metrics()
+    generate, calls = _scripted([RESEARCH_BODY[:-1], RESEARCH_BODY])
+    assert generate_structured("research", RESEARCH_SCHEMA, generate, route="research") == VALID_RESEARCH
+    assert "did not contain a valid JSON object" in calls[1][0]
+    metrics = get_metrics()["research"]
+    assert metrics["parse_failures"] == 1
+    assert metrics["validation_failures"] == 0
+
+
+
+def test_decoy_objects_do_not_cost_a_repair():
+    for sample in DECOYED:
+        reset_metrics()
+        generate, calls = _scripted([sample])
+        assert generate_structured("analyze", PROGRESSION_SCHEMA, generate, route="progression") == VALID_PROGRESSION
+        assert len(calls) == 1
+        metrics = get_metrics()["progression"]
+        assert metrics["successes"] == 1 and metrics["validation_failures"] == 0
+
+
+def test_generation_errors_are_counted_and_retried():
+    reset_metrics()
+    blocked = ValueError("response was blocked by safety filters")
+    generate, calls = _scripted([blocked, BODY])
+    assert generate_structured("analyze", PROGRESSION_SCHEMA, generate, route="progression") == VALID_PROGRESSION
+    assert calls[0][0] == calls[1][0]
+    assert get_metrics()["progression"]["generation_errors"] == 1
+
+    reset_metrics()
+    generate, calls = _scripted([blocked] * 3)
+    assert generate_structured("analyze", PROGRESSION_SCHEMA, generate, route="progression") is None
+    assert len(calls) == 3
+    metrics = get_metrics()["progression"]
+    assert metrics["generation_errors"] == 3 and metrics["exhausted"] == 1
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"PASS: {name}")